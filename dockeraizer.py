@@ -1,20 +1,143 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-from pathlib import Path
 from typing import Dict, List
-from litellm import completion
+from litellm import acompletion
 
+SYSTEM_PROMPT = """You are an experienced DevOps engineer. Based on the provided directory structure and configuration files:
+            1. First provide a brief summary of the project and your containerization approach (2-3 sentences)
+            2. Create an appropriate Dockerfile optimized for the project
+            3. Create a docker-compose.yml file with necessary services and configurations
 
-def read_important_files(directory_path: str) -> Dict[str, str]:
-    """
-    Read contents of important configuration files in the project directory.
+            Start with the summary in plain text, then provide the Dockerfile and docker-compose.yml files in markdown code blocks with appropriate labels."""
+
+# st.write_stream rerenders on every yield while LiteLLM emits one token per
+# chunk, so batch chunks before handing them to the UI.
+_STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "8"))
+_STREAM_BATCH_SECS = int(os.environ.get("STREAM_BATCH_MS", "50")) / 1000.0
+
+# Config files that identify a project's ecosystem, and per-stack guidance
+# appended to the base prompt. A specialized prompt is shorter for the model
+# to reason over than one hedging across every ecosystem.
+_STACK_MARKERS = {
+    "python": ("requirements.txt", "setup.py", "pyproject.toml", "Pipfile"),
+    "node": ("package.json", "package-lock.json"),
+    "java": ("pom.xml", "build.gradle"),
+    "go": ("go.mod",),
+    "rust": ("Cargo.toml",),
+}
+
+_STACK_GUIDANCE = {
+    "python": "This is a Python project: use a slim python base image, install dependencies in their own cached layer, and run the app as a non-root user.",
+    "node": "This is a Node.js project: use a slim node base image, install with npm ci (or the project's lockfile tool) in a cached layer, and avoid copying node_modules from the host.",
+    "java": "This is a Java project: use a multi-stage build that compiles with Maven or Gradle and ships only the resulting artifact on a JRE base image.",
+    "go": "This is a Go project: use a multi-stage build that compiles a static binary and ships it on a minimal base image such as alpine or distroless.",
+    "rust": "This is a Rust project: use a multi-stage build that compiles with cargo in the builder stage and ships only the release binary on a minimal base image.",
+}
+
+
+def _build_system_messages(prompt: str):
+    """Return the plain and Anthropic cache-control variants of a system message."""
+    return (
+        {"role": "system", "content": prompt},
+        {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+        },
+    )
 
-    Args:
-        directory_path (str): Path to the project directory
 
-    Returns:
-        Dict mapping filenames to their contents
-    """
-    important_files = [
+# Prebuilt per-stack system messages; never mutate these. Each variant is a
+# stable, byte-identical prefix, which is what keeps provider prompt caches
+# hitting across calls for the same stack.
+_SYSTEM_MSGS = {"generic": _build_system_messages(SYSTEM_PROMPT)}
+for _stack, _guidance in _STACK_GUIDANCE.items():
+    _SYSTEM_MSGS[_stack] = _build_system_messages(
+        f"{SYSTEM_PROMPT}\n\n            {_guidance}"
+    )
+
+_ANTHROPIC_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+
+def _detect_stack(config_files: Dict[str, str]) -> str:
+    """Map the found config files to a single ecosystem, or 'generic'."""
+    stacks = {
+        stack
+        for stack, markers in _STACK_MARKERS.items()
+        if any(marker in config_files for marker in markers)
+    }
+    if len(stacks) == 1:
+        return stacks.pop()
+    return "generic"
+
+# Directories that are huge, machine-generated, and useless to the LLM.
+_SKIP_DIRS = frozenset(
+    {
+        "node_modules",
+        ".git",
+        ".venv",
+        "venv",
+        "__pycache__",
+        "target",
+        "dist",
+        "build",
+        ".next",
+        ".nuxt",
+        ".pytest_cache",
+        ".mypy_cache",
+        ".cache",
+    }
+)
+# Bounds on the rendered tree so pathological repos cannot stall the walk.
+_MAX_DEPTH = 6
+_MAX_ENTRIES_PER_DIR = 2000
+
+_EMOJI = {
+    ".py": "📜",
+    ".java": "📜",
+    ".cpp": "📜",
+    ".js": "📜",
+    ".jpg": "🖼️",
+    ".png": "🖼️",
+    ".gif": "🖼️",
+    ".bmp": "🖼️",
+    ".pdf": "📄",
+    ".doc": "📄",
+    ".docx": "📄",
+    ".txt": "📄",
+}
+_DEFAULT_EMOJI = "📋"
+
+# Per-file caps on content included in the prompt. Lockfiles can reach
+# multiple MB while adding almost nothing to Docker generation quality, so
+# they get a much tighter budget than hand-written configs.
+_MAX_BYTES = {
+    "package-lock.json": 2048,
+    "go.sum": 2048,
+    "Cargo.lock": 2048,
+}
+_MAX_BYTES_DEFAULT = 32_768
+# Files above this size are mapped rather than read, so only the bytes that
+# fit the prompt budget are ever decoded.
+_MMAP_THRESHOLD = 65_536
+
+_IMPORTANT_FILES = frozenset(
+    {
         # Python
         "requirements.txt",
         "setup.py",
@@ -37,144 +160,283 @@ def read_important_files(directory_path: str) -> Dict[str, str]:
         "config.json",
         "config.yaml",
         "config.yml",
-    ]
+    }
+)
 
-    found_files = {}
-    path = Path(directory_path)
 
-    for filename in important_files:
-        file_path = path / filename
-        if file_path.is_file():
-            try:
-                content = file_path.read_text()
-                found_files[filename] = content
-            except Exception as e:
-                found_files[filename] = f"Error reading file: {str(e)}"
-
-    return found_files
+# The 30s TTL bounds staleness: editing a config file in place does not
+# change the directory's mtime, so time is the only reliable invalidator.
+@st.cache_data(show_spinner=False, max_entries=32, ttl=30)
+def read_important_files(directory_path: str) -> Dict[str, str]:
+    """
+    Read contents of important configuration files in the project directory.
 
+    Args:
+        directory_path (str): Path to the project directory
 
-def generate_directory_markdown(directory_path: str, indent_level: int = 0) -> str:
-    """Generate a markdown representation of a directory structure."""
-    path = Path(directory_path)
-    markdown = ""
+    Returns:
+        Dict mapping filenames to their contents
+    """
+    # One scandir pass tells us which candidates exist, replacing a stat()
+    # per candidate name (most of which would just return ENOENT).
+    try:
+        with os.scandir(directory_path) as it:
+            present = {e.name: e.path for e in it if e.is_file()}
+    except OSError:
+        # Not a directory, unreadable, or gone — same as finding nothing.
+        return {}
+
+    def _try_read(filename):
+        cap = _MAX_BYTES.get(filename, _MAX_BYTES_DEFAULT)
+        try:
+            with open(present[filename], "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size > _MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content = mm[:cap].decode("utf-8", errors="replace")
+                    return filename, content + f"\n...[truncated {size - cap} bytes]"
+                content = f.read().decode("utf-8", errors="replace")
+        except Exception as e:
+            return filename, f"Error reading file: {str(e)}"
+        if len(content) > cap:
+            content = content[:cap] + f"\n...[truncated {len(content) - cap} bytes]"
+        return filename, content
+
+    to_read = sorted(_IMPORTANT_FILES & present.keys())
+    if not to_read:
+        return {}
+
+    # The reads are latency-bound, so let the filesystem service them
+    # concurrently instead of one at a time.
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = executor.map(_try_read, to_read)
+
+    return dict(results)
+
+
+def _walk_directory(directory_path: str, indent_level: int):
+    """Yield one markdown line per directory entry, depth-first."""
+    indent = "    " * indent_level
 
     try:
-        items = [item for item in path.iterdir() if not item.name.startswith(".")]
-        items = sorted(items, key=lambda x: (not x.is_dir(), x.name.lower()))
-
-        for item in items:
-            indent = "    " * indent_level
-            if item.is_dir():
-                markdown += f"{indent}📁 **{item.name}/**\n"
-                markdown += generate_directory_markdown(str(item), indent_level + 1)
-            else:
-                extension = item.suffix.lower()
-                if extension in [".py", ".java", ".cpp", ".js"]:
-                    emoji = "📜"
-                elif extension in [".jpg", ".png", ".gif", ".bmp"]:
-                    emoji = "🖼️"
-                elif extension in [".pdf", ".doc", ".docx", ".txt"]:
-                    emoji = "📄"
+        # Compute the sort key once per entry so is_dir() is not called again
+        # inside the loop.
+        with os.scandir(directory_path) as it:
+            entries = [
+                (not entry.is_dir(follow_symlinks=False), entry.name.lower(), entry)
+                for entry in it
+                if not entry.name.startswith(".")
+            ]
+        entries.sort(key=lambda item: item[:2])
+
+        if len(entries) > _MAX_ENTRIES_PER_DIR:
+            omitted = len(entries) - _MAX_ENTRIES_PER_DIR
+            entries = entries[:_MAX_ENTRIES_PER_DIR]
+        else:
+            omitted = 0
+
+        for is_file, _, entry in entries:
+            if not is_file:
+                if entry.name in _SKIP_DIRS:
+                    yield f"{indent}📁 **{entry.name}/** *(skipped)*\n"
+                    continue
+                yield f"{indent}📁 **{entry.name}/**\n"
+                if indent_level + 1 < _MAX_DEPTH:
+                    yield from _walk_directory(entry.path, indent_level + 1)
                 else:
-                    emoji = "📋"
-                markdown += f"{indent}{emoji} {item.name}\n"
+                    yield f"{indent}    ⋯ *(max depth reached)*\n"
+            else:
+                extension = os.path.splitext(entry.name)[1].lower()
+                emoji = _EMOJI.get(extension, _DEFAULT_EMOJI)
+                yield f"{indent}{emoji} {entry.name}\n"
+
+        if omitted:
+            yield f"{indent}⋯ *({omitted} more entries omitted)*\n"
 
     except PermissionError:
-        markdown += f"{indent}❌ *Access Denied*\n"
+        yield f"{indent}❌ *Access Denied*\n"
     except Exception as e:
-        markdown += f"{indent}❌ *Error: {str(e)}*\n"
+        yield f"{indent}❌ *Error: {str(e)}*\n"
+
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=30)
+def _walk_cached(directory_path: str, indent_level: int, mtime_key: int) -> str:
+    """Render the tree, cached on the root directory's mtime.
+
+    The mtime only changes when entries are added or removed at the top
+    level, not on deep edits — the TTL bounds staleness for those — and it
+    turns repeat walks of an unchanged tree into a cache lookup.
+    """
+    return "".join(_walk_directory(directory_path, indent_level))
 
-    return markdown
+
+def generate_directory_markdown(directory_path: str, indent_level: int = 0) -> str:
+    """Generate a markdown representation of a directory structure."""
+    try:
+        mtime_key = os.stat(directory_path).st_mtime_ns
+    except OSError:
+        return "".join(_walk_directory(directory_path, indent_level))
+    return _walk_cached(directory_path, indent_level, mtime_key)
+
+
+# Matches a fenced code block, capturing its language tag and body.
+_FENCE_RE = re.compile(r"```([a-zA-Z0-9_\-.]*)[ \t]*\n(.*?)```", re.DOTALL)
+
+# Language tags treated as a docker-compose block.
+_COMPOSE_TAGS = frozenset({"yaml", "yml", "docker-compose", "docker-compose.yml"})
 
 
 def extract_docker_files(response: str) -> tuple:
     """Extract Dockerfile, docker-compose.yml content and summary from the response."""
     dockerfile = ""
     docker_compose = ""
-    summary = ""
-
-    blocks = response.split("```")
 
-    # Extract summary (assumes it's before any code blocks)
-    if blocks and not blocks[0].strip().lower().startswith("dockerfile"):
-        summary = blocks[0].strip()
-        blocks = blocks[1:]
+    matches = list(_FENCE_RE.finditer(response))
 
-    blocks = [block for block in blocks if block.strip()]
+    # Summary is whatever precedes the first code block
+    summary = response[: matches[0].start()].strip() if matches else response.strip()
 
-    for block in blocks:
-        if block.strip().lower().startswith("dockerfile"):
-            dockerfile = block.replace("dockerfile", "").strip()
-        elif block.strip().lower().startswith(("yaml", "docker-compose")):
-            docker_compose = (
-                block.replace("docker-compose.yml", "").replace("yaml", "").strip()
-            )
+    for match in matches:
+        tag = match.group(1).lower()
+        if tag == "dockerfile":
+            dockerfile = match.group(2).strip()
+        elif tag in _COMPOSE_TAGS:
+            docker_compose = match.group(2).strip()
 
     return dockerfile, docker_compose, summary
 
 
-def stream_response(directory_path: str, model: str, api_key: str):
-    """Stream responses from the AI model."""
-    # Generate directory structure
-    directory_markdown = generate_directory_markdown(directory_path)
+def _stream_in_background(completion_kwargs: dict) -> "queue.Queue":
+    """Run the async completion in a background thread, feeding a bounded queue.
 
-    # Read important configuration files
-    config_files = read_important_files(directory_path)
+    The Streamlit script thread then consumes chunks with blocking get() calls
+    instead of sitting inside the provider's iterator between token arrivals.
+    The queue bound applies backpressure so a fast model cannot flood memory;
+    None is the end-of-stream sentinel and exceptions are passed through.
+    """
+    chunk_queue = queue.Queue(maxsize=64)
 
-    # Create the prompt with all available information
-    config_files_text = "\n\n".join(
-        f"=== {filename} ===\n{content}" for filename, content in config_files.items()
-    )
+    async def _pump():
+        response = await acompletion(**completion_kwargs)
+        async for part in response:
+            chunk = part.choices[0].delta.content
+            if chunk:
+                chunk_queue.put(chunk)
 
-    complete_prompt = f"""
-Directory Structure:
-{directory_markdown}
+    def _run():
+        try:
+            asyncio.run(_pump())
+        except Exception as e:
+            chunk_queue.put(e)
+        finally:
+            chunk_queue.put(None)
 
-Configuration Files Found:
-{config_files_text}
-"""
+    threading.Thread(target=_run, daemon=True).start()
+    return chunk_queue
 
-    messages = [
+
+def _record_docker_files(full_response: str):
+    """Parse a finished response and store the extracted files in session state."""
+    dockerfile, docker_compose, summary = extract_docker_files(full_response)
+    if "docker_files" not in st.session_state:
+        st.session_state.docker_files = []
+    st.session_state.docker_files.append(
         {
-            "role": "system",
-            "content": """You are an experienced DevOps engineer. Based on the provided directory structure and configuration files:
-            1. First provide a brief summary of the project and your containerization approach (2-3 sentences)
-            2. Create an appropriate Dockerfile optimized for the project
-            3. Create a docker-compose.yml file with necessary services and configurations
-            
-            Start with the summary in plain text, then provide the Dockerfile and docker-compose.yml files in markdown code blocks with appropriate labels.""",
-        },
-        {"role": "user", "content": complete_prompt},
+            "timestamp": st.session_state.get("message_count", 0),
+            "dockerfile": dockerfile,
+            "docker_compose": docker_compose,
+            "summary": summary,
+        }
+    )
+    st.session_state.message_count = st.session_state.get("message_count", 0) + 1
+
+
+def stream_response(
+    directory_markdown: str,
+    config_files: Dict[str, str],
+    model: str,
+    api_key: str,
+    bypass_cache: bool = False,
+):
+    """Stream responses from the AI model."""
+    # Create the prompt with all available information. Build it as one list
+    # and join once so large file contents are not copied an extra time
+    # through an intermediate string.
+    prompt_parts = [
+        "\nDirectory Structure:\n",
+        directory_markdown,
+        "\n\nConfiguration Files Found:\n",
     ]
+    for filename, content in config_files.items():
+        prompt_parts += ("=== ", filename, " ===\n", content, "\n\n")
+    complete_prompt = "".join(prompt_parts)
+
+    # Same directory + same model means substantially the same answer, so a
+    # session-level cache can skip the LLM round-trip entirely.
+    cache_key = hashlib.blake2b(
+        f"{model}\n{complete_prompt}".encode(), digest_size=16
+    ).hexdigest()
+    if "response_cache" not in st.session_state:
+        st.session_state.response_cache = OrderedDict()
+    cache = st.session_state.response_cache
+
+    if not bypass_cache and cache_key in cache:
+        cache.move_to_end(cache_key)
+        full_response = cache[cache_key]
+        # Replay in slices so the UI still renders progressively.
+        for i in range(0, len(full_response), 256):
+            yield full_response[i : i + 256]
+        _record_docker_files(full_response)
+        return
+
+    # The static system prompt goes first so providers with automatic prefix
+    # caching (e.g. OpenAI) can reuse it; Anthropic needs an explicit marker.
+    plain_msg, anthropic_msg = _SYSTEM_MSGS[_detect_stack(config_files)]
+    extra_kwargs = {}
+    if model.startswith("anthropic/"):
+        system_msg = anthropic_msg
+        extra_kwargs["extra_headers"] = _ANTHROPIC_HEADERS
+    else:
+        system_msg = plain_msg
+
+    messages = [system_msg, {"role": "user", "content": complete_prompt}]
 
     try:
-        response = completion(
-            model=model, messages=messages, stream=True, api_key=api_key
+        chunk_queue = _stream_in_background(
+            dict(
+                model=model,
+                messages=messages,
+                stream=True,
+                api_key=api_key,
+                **extra_kwargs,
+            )
         )
 
-        full_response = ""
-        for part in response:
-            chunk = part.choices[0].delta.content
-            if chunk:
-                full_response += chunk
-                yield chunk
-
+        parts = []
+        buf = []
+        last_yield = time.monotonic()
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            parts.append(chunk)
+            buf.append(chunk)
+            now = time.monotonic()
+            if len(buf) >= _STREAM_BATCH_SIZE or now - last_yield > _STREAM_BATCH_SECS:
+                yield "".join(buf)
+                buf.clear()
+                last_yield = now
+        if buf:
+            yield "".join(buf)
+
+        full_response = "".join(parts)
         if full_response:
-            dockerfile, docker_compose, summary = extract_docker_files(full_response)
-            if "docker_files" not in st.session_state:
-                st.session_state.docker_files = []
-            st.session_state.docker_files.append(
-                {
-                    "timestamp": st.session_state.get("message_count", 0),
-                    "dockerfile": dockerfile,
-                    "docker_compose": docker_compose,
-                    "summary": summary,
-                }
-            )
-            st.session_state.message_count = (
-                st.session_state.get("message_count", 0) + 1
-            )
+            cache[cache_key] = full_response
+            while len(cache) > 32:
+                cache.popitem(last=False)
+            _record_docker_files(full_response)
 
     except Exception as e:
         yield f"Error during streaming: {str(e)}"
@@ -274,26 +536,39 @@ def main():
             st.error("Please enter your API key in the sidebar first!")
             return
 
-        path = Path(directory_path)
-        if not path.exists():
+        if not os.path.exists(directory_path):
             st.error("❌ Directory does not exist! Please provide a valid path.")
         else:
+            # Walk the tree and read configs once, then reuse the results for
+            # both expanders and the prompt below.
+            directory_markdown = generate_directory_markdown(directory_path)
+            config_files = read_important_files(directory_path)
+
             # Show directory structure
             with st.expander("View Directory Structure"):
-                st.markdown(
-                    f"```markdown\n{generate_directory_markdown(directory_path)}\n```"
-                )
+                st.markdown(f"```markdown\n{directory_markdown}\n```")
 
             # Show found configuration files
-            config_files = read_important_files(directory_path)
             with st.expander("View Found Configuration Files"):
                 for filename, content in config_files.items():
                     st.text(f"Found: {filename}")
 
             # Generate Docker configurations
             st.subheader("🔍 Analysis & Recommendations")
+            regenerate = st.button(
+                "🔄 Regenerate",
+                help="Skip the cached response and ask the model again",
+            )
             with st.chat_message("assistant"):
-                st.write_stream(stream_response(directory_path, model, api_key))
+                st.write_stream(
+                    stream_response(
+                        directory_markdown,
+                        config_files,
+                        model,
+                        api_key,
+                        bypass_cache=regenerate,
+                    )
+                )
 
 
 if __name__ == "__main__":